@@ -2,12 +2,18 @@
 # -*- coding: utf-8 -*-
 import os
 import io
+import itertools
 import time
-from typing import Optional, Tuple, List
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Tuple, List, Dict
 
+import numpy as np
+import orjson
 import pandas as pd
 import requests
 import streamlit as st
+import urllib3
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
@@ -76,10 +82,14 @@ def _rerun():
         if hasattr(st, "experimental_rerun"):
             st.experimental_rerun()
 
+# st.fragment (>= 1.37) ou experimental_fragment; sem suporte, roda como função comum
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda fn: fn)
+
 # =========================================================
-# CLIENTE HTTP (API) — sessão com retries
+# CLIENTE HTTP (API) — sessão com retries e pool de conexões
 # =========================================================
-def _requests_session_with_retries(total=3, backoff=0.5, status_forcelist=(502, 503, 504)):
+def _requests_session_with_retries(total=3, backoff=0.2, status_forcelist=(502, 503, 504),
+                                   pool_connections=10, pool_maxsize=20):
     sess = requests.Session()
     retries = Retry(
         total=total,
@@ -87,34 +97,33 @@ def _requests_session_with_retries(total=3, backoff=0.5, status_forcelist=(502,
         status_forcelist=status_forcelist,
         allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE", "PATCH", "HEAD", "OPTIONS"])
     )
-    adapter = HTTPAdapter(max_retries=retries)
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=retries
+    )
     sess.mount("http://", adapter)
     sess.mount("https://", adapter)
+    sess.headers["X-API-Key"] = API_TOKEN
     return sess
 
-_session = _requests_session_with_retries()
+@st.cache_resource(show_spinner=False)
+def _get_session() -> requests.Session:
+    """Sessão única por processo (keep-alive); sobrevive aos reruns do Streamlit."""
+    return _requests_session_with_retries()
 
-def call_api(method: str, path: str, **kwargs):
-    """Chama a API com cabeçalho X-API-Key e trata erros comuns."""
-    url = f"{API_BASE.rstrip('/')}/{path.lstrip('/')}"
-    headers = kwargs.pop("headers", {}) or {}
-    headers["X-API-Key"] = API_TOKEN
-    timeout = kwargs.pop("timeout", API_TIMEOUT)
+class NaoModificado(Exception):
+    """Resposta 304: o conteúdo não mudou desde o ETag enviado em If-None-Match."""
+
+    def __init__(self, path: str, etag: str):
+        super().__init__(path, etag)
+        self.etag = etag
 
+@contextmanager
+def _erros_api(path: str):
+    """Converte falhas de rede/HTTP (inclusive na leitura do corpo) em RuntimeError legível."""
     try:
-        r = _session.request(
-            method=method.upper(),
-            url=url,
-            headers=headers,
-            timeout=timeout,
-            verify=API_VERIFY_SSL,
-            **kwargs
-        )
-        r.raise_for_status()
-        # Tenta JSON; se não for, retorna None
-        if r.content and "application/json" in (r.headers.get("Content-Type") or ""):
-            return r.json()
-        return None
+        yield
 
     except requests.exceptions.SSLError as ex:
         raise RuntimeError(
@@ -152,6 +161,68 @@ def call_api(method: str, path: str, **kwargs):
             raise RuntimeError("Não autorizado (401). Verifique o token em Settings → Segredos.") from ex
         raise RuntimeError(f"Falha HTTP {status} em {path}: {body}") from ex
 
+    except (requests.exceptions.ChunkedEncodingError, urllib3.exceptions.HTTPError) as ex:
+        # Corpo em streaming: conexão caiu/expirou enquanto o conteúdo era lido
+        if isinstance(ex, urllib3.exceptions.ReadTimeoutError):
+            raise RuntimeError(
+                f"Falha ao chamar API {path}: timeout de leitura. O endpoint pode estar lento."
+            ) from ex
+        raise RuntimeError(
+            f"Falha ao chamar API {path}: conexão interrompida durante a leitura da resposta ({ex})."
+        ) from ex
+
+    except requests.exceptions.RequestException as ex:
+        # Demais erros do requests (URL/esquema/cabeçalho inválidos etc.); vários também
+        # herdam de ValueError e não devem ser confundidos com JSON inválido
+        raise RuntimeError(
+            f"Falha ao chamar API {path}: requisição inválida ({ex}). "
+            f"Confirme a URL base ({API_BASE}) e o token configurados."
+        ) from ex
+
+    except ValueError as ex:
+        # JSON/NDJSON malformado no corpo
+        raise RuntimeError(f"Falha ao chamar API {path}: resposta JSON inválida ({ex}).") from ex
+
+def call_api(method: str, path: str, stream: bool = False, etag: Optional[str] = None, **kwargs):
+    """
+    Chama a API (X-API-Key já vai na sessão) e trata erros comuns.
+    Com stream=True devolve o próprio Response (corpo ainda não lido);
+    quem chama deve fechá-lo (use em bloco `with`).
+    Com etag="..." envia If-None-Match e levanta NaoModificado em caso de 304;
+    guardar o ETag da resposta (junto do conteúdo) fica a cargo de quem chama.
+    """
+    url = f"{API_BASE.rstrip('/')}/{path.lstrip('/')}"
+    headers = kwargs.pop("headers", None)
+    timeout = kwargs.pop("timeout", API_TIMEOUT)
+    sess = _get_session()
+    if etag:
+        headers = {**(headers or {}), "If-None-Match": etag}
+    if "json" in kwargs:
+        # Corpo serializado com orjson (mais rápido que o json da stdlib usado pelo requests)
+        kwargs["data"] = orjson.dumps(kwargs.pop("json"))
+        headers = {**(headers or {}), "Content-Type": "application/json"}
+
+    with _erros_api(path):
+        r = sess.request(
+            method=method.upper(),
+            url=url,
+            headers=headers,
+            timeout=timeout,
+            verify=API_VERIFY_SSL,
+            stream=stream,
+            **kwargs
+        )
+        if etag and r.status_code == 304:
+            r.close()
+            raise NaoModificado(path, etag)
+        r.raise_for_status()
+        if stream:
+            return r
+        # Tenta JSON; se não for, retorna None
+        if r.content and "application/json" in (r.headers.get("Content-Type") or ""):
+            return orjson.loads(r.content)
+        return None
+
 @st.cache_data(ttl=15)
 def api_status() -> bool:
     try:
@@ -192,66 +263,235 @@ def authenticate_user(login: str, senha: str) -> Tuple[bool, Optional[str]]:
         return False, None
     return (bool(data.get("ok")), data.get("nome"))
 
-@st.cache_data(ttl=30)
-def carregar_sugestoes() -> pd.DataFrame:
-    data = call_api("GET", "/sugestoes")
-    if not data:
+@st.cache_resource(show_spinner=False)
+def _get_executor() -> ThreadPoolExecutor:
+    """Pool de threads para chamadas à API em segundo plano."""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="sn_api")
+
+@st.cache_resource(show_spinner=False)
+def _get_sequencia_pedidos() -> itertools.count:
+    """Numeração crescente dos pedidos a /sugestoes (ordena respostas concorrentes)."""
+    return itertools.count(1)
+
+def _baixar_sugestoes(etag: Optional[str] = None) -> Tuple[int, Optional[str], pd.DataFrame]:
+    """
+    GET /sugestoes sem tratamento de colunas (seguro para rodar fora da thread do script).
+    Devolve (nº do pedido, ETag da resposta, DataFrame); levanta NaoModificado se o
+    servidor responder 304 ao `etag` informado.
+    """
+    pedido = next(_get_sequencia_pedidos())  # numerado antes do envio, não na chegada
+    # Lê o corpo direto do socket para o pandas, sem montar r.text/r.json() antes
+    with call_api("GET", "/sugestoes", stream=True, etag=etag,
+                  headers={"Accept": "application/x-ndjson, application/json"}) as r, \
+            _erros_api("/sugestoes"):
+        ctype = r.headers.get("Content-Type") or ""
+        novo_etag = r.headers.get("ETag")
+        if "ndjson" in ctype:
+            # Um registro por linha: parse incremental com orjson, sem o corpo inteiro em memória
+            linhas = r.iter_lines(chunk_size=64 * 1024)  # padrão de 512 B leria aos pedacinhos
+            return pedido, novo_etag, pd.DataFrame([orjson.loads(linha) for linha in linhas if linha])
+        if "application/json" not in ctype:
+            return pedido, None, pd.DataFrame()  # mesmo comportamento do call_api para respostas não-JSON
+        r.raw.decode_content = True  # descompacta gzip/deflate, se houver
+        return pedido, novo_etag, pd.read_json(r.raw, orient="records", dtype=False, convert_dates=False)
+
+def prefetch_sugestoes():
+    """Dispara (ou renova) o download de /sugestoes em segundo plano para esta sessão."""
+    _, etag, _ = _get_ultimas_respostas().get("/sugestoes", (None, None, None))
+    futuro = _get_executor().submit(_baixar_sugestoes, etag)
+    st.session_state["_sugestoes_future"] = (time.monotonic(), futuro)
+
+def _prefetch_recente() -> Optional[Future]:
+    """Consome o prefetch da sessão; descarta o que foi disparado há mais que o TTL."""
+    disparado_em, futuro = st.session_state.pop("_sugestoes_future", (0.0, None))
+    if futuro is None or time.monotonic() - disparado_em > SUGESTOES_TTL:
+        return None
+    return futuro
+
+# Tipos das colunas de /sugestoes (nomes da API). MARCA, TIPO_SUGESTAO, VENDEDOR,
+# ACAO_COMPRADOR e ORDEM_COMPRA entram como "string" e viram category após o rename.
+SUGESTOES_DTYPES = {
+    "REFERENCIA": "string[pyarrow]",
+    "QUANTIDADE": "Int64",
+    "MARCA": "string",
+    "TIPO_SUGESTAO": "string",
+    "COMENTARIO_VENDEDOR": "string",
+    "VENDEDOR": "string",
+    "ACAO_COMPRADOR": "string",
+    "COMENTARIO_COMPRADOR": "string",
+    "ORDEM_COMPRA": "string",
+    "CODIGO": "string[pyarrow]",
+    "DESCRICAO_CODIGO": "string[pyarrow]",
+    "DATA_LANCAMENTO": "string",
+}
+
+# Nomes de exibição das colunas de /sugestoes
+_RENAME_MAP = {
+    "REFERENCIA": "Referência",
+    "QUANTIDADE": "Quantidade",
+    "MARCA": "Marca",
+    "TIPO_SUGESTAO": "Tipo Sugestão",
+    "COMENTARIO_VENDEDOR": "Comentário Vendedor",
+    "VENDEDOR": "Vendedor",
+    "ACAO_COMPRADOR": "Ação Comprador",
+    "COMENTARIO_COMPRADOR": "Comentário Comprador",
+    "ORDEM_COMPRA": "Ordem Compra",
+    "CODIGO": "Código",
+    "DESCRICAO_CODIGO": "Descrição Código",
+    "DATA_LANCAMENTO": "Data Lançamento"
+}
+
+# Opções fixas do formulário de sugestão (montadas uma vez, não a cada rerun)
+_QUANTIDADES = tuple(range(1, 1001))
+_TIPOS = ("VENDA_CASADA", "VENDA_PERDIDA")
+
+# Validade (s) do DataFrame de /sugestoes em cache e de um prefetch ainda não consumido
+SUGESTOES_TTL = 30
+
+@st.cache_resource(show_spinner=False)
+def _get_ultimas_respostas() -> Dict[str, Tuple[int, str, pd.DataFrame]]:
+    """
+    (nº do pedido, ETag, DataFrame tratado) por path; gravados juntos e reaproveitados
+    no 304. Uma resposta só substitui a guardada se o pedido dela for mais recente.
+    """
+    return {}
+
+@st.cache_resource(ttl=SUGESTOES_TTL, show_spinner=False)
+def carregar_sugestoes(_prefetch: Optional[Future] = None) -> pd.DataFrame:
+    """
+    DataFrame de /sugestoes compartilhado (singleton, sem cópia por rerun).
+    Somente leitura: quem precisar alterar deve trabalhar sobre um .copy().
+    df.attrs["versao"] identifica os dados (nº do pedido que os trouxe).
+    """
+    ultimas = _get_ultimas_respostas()
+    _, etag_atual, _ = ultimas.get("/sugestoes", (None, None, None))
+    # _prefetch fica fora da chave do cache (prefixo "_"); só é usado em cache miss
+    try:
+        resultado = None
+        if _prefetch is not None:
+            try:
+                resultado = _prefetch.result(timeout=API_TIMEOUT)
+            except NaoModificado:
+                raise
+            except Exception:
+                resultado = None  # prefetch falhou/expirou: busca direta abaixo
+        if resultado is None:
+            resultado = _baixar_sugestoes(etag_atual)
+    except NaoModificado as ex:
+        guardado = ultimas.get("/sugestoes")
+        if guardado is not None and guardado[1] == ex.etag:
+            return guardado[2]
+        # O payload guardado não é o do ETag revalidado: baixa completo
+        resultado = _baixar_sugestoes()
+
+    pedido, etag, df = resultado
+    guardado = ultimas.get("/sugestoes")
+    if guardado is not None and guardado[0] > pedido:
+        return guardado[2]  # um pedido posterior já respondeu: não volta para dados mais antigos
+    df = _tratar_sugestoes(df)
+    df.attrs["versao"] = pedido
+    # ETag e DataFrame só são gravados juntos, depois do tratamento bem-sucedido
+    if etag:
+        ultimas["/sugestoes"] = (pedido, etag, df)
+    return df
+
+def _tratar_sugestoes(df: pd.DataFrame) -> pd.DataFrame:
+    """Tipos, nomes de exibição e formatação de /sugestoes."""
+    if df.empty:
         return pd.DataFrame()
-    df = pd.DataFrame(data)
+
+    # Tipos declarados de uma vez (sem inferência coluna a coluna nem colunas object)
+    df = df.astype({c: t for c, t in SUGESTOES_DTYPES.items() if c in df.columns})
 
     # Renomear colunas para exibição amigável
-    rename_map = {
-        "REFERENCIA": "Referência",
-        "QUANTIDADE": "Quantidade",
-        "MARCA": "Marca",
-        "TIPO_SUGESTAO": "Tipo Sugestão",
-        "COMENTARIO_VENDEDOR": "Comentário Vendedor",
-        "VENDEDOR": "Vendedor",
-        "ACAO_COMPRADOR": "Ação Comprador",
-        "COMENTARIO_COMPRADOR": "Comentário Comprador",
-        "ORDEM_COMPRA": "Ordem Compra",
-        "CODIGO": "Código",
-        "DESCRICAO_CODIGO": "Descrição Código",
-        "DATA_LANCAMENTO": "Data Lançamento"
-    }
-    df = df.rename(columns=rename_map)
+    df = df.rename(columns=_RENAME_MAP)
+
+    # Colunas de baixa cardinalidade como category (comparações e unique() sobre códigos inteiros)
+    for c in ("Marca", "Tipo Sugestão", "Vendedor", "Ação Comprador", "Ordem Compra"):
+        if c in df.columns:
+            df[c] = df[c].astype("category")
 
     # Data/Hora pt-BR completa
     if "Data Lançamento" in df.columns:
-        data_dt = pd.to_datetime(df["Data Lançamento"], errors="coerce", dayfirst=True)
+        bruto = df["Data Lançamento"]
+        # A API envia ISO 8601: formato explícito evita a inferência linha a linha
+        data_dt = pd.to_datetime(bruto, errors="coerce", format="ISO8601")
+        # Fallback apenas para valores fora do padrão ISO (ex.: "dd/mm/aaaa")
+        falhas = data_dt.isna() & bruto.notna()
+        if falhas.any():
+            data_dt[falhas] = pd.to_datetime(bruto[falhas], errors="coerce", dayfirst=True)
         df["Data Lançamento"] = data_dt.dt.strftime("%d/%m/%Y %H:%M:%S").fillna("")
 
     # Código sem separadores
     if "Código" in df.columns:
-        def _clean_code(x):
-            if pd.isna(x):
-                return ""
-            s = str(x)
-            return s.replace(".", "").replace(",", "").strip()
-        df["Código"] = df["Código"].apply(_clean_code)
+        df["Código"] = (
+            df["Código"].astype("string[pyarrow]")
+            .str.replace(".", "", regex=False)
+            .str.replace(",", "", regex=False)
+            .str.strip()
+            .fillna("")
+        )
 
     return df
 
-def carregar_itens_por_referencia(referencia: str) -> List[tuple]:
-    referencia = (referencia or "").strip()
+# Itens de uma referência em colunas paralelas (códigos[i] ↔ descrições[i])
+_ITENS_VAZIO: Dict[str, Tuple[str, ...]] = {"codigos": (), "descricoes": ()}
+
+@st.cache_data(ttl=600, max_entries=512, show_spinner=False)
+def carregar_itens_por_referencia(referencia: str) -> Dict[str, Tuple[str, ...]]:
+    referencia = (referencia or "").strip().upper()
     if not referencia:
-        return []
+        return _ITENS_VAZIO
     items = call_api("GET", f"/itens/{referencia}")
     if not items:
-        return []
-    out: List[tuple] = []
-    for it in items:
-        cod = "" if it.get("codigo") is None else str(it.get("codigo"))
-        desc = "" if it.get("descricao") is None else str(it.get("descricao"))
-        out.append((cod, desc))
+        return _ITENS_VAZIO
     # remove duplicados preservando ordem
-    seen = set()
-    dedup = []
-    for t in out:
-        if t not in seen:
-            seen.add(t)
-            dedup.append(t)
-    return dedup
+    pares = list(dict.fromkeys(
+        ("" if it.get("codigo") is None else str(it["codigo"]),
+         "" if it.get("descricao") is None else str(it["descricao"]))
+        for it in items
+    ))
+    if not pares:
+        return _ITENS_VAZIO
+    codigos, descricoes = zip(*pares)
+    return {"codigos": codigos, "descricoes": descricoes}
+
+# Colunas que alimentam os selectbox de filtro da consulta
+FILTRO_COLUNAS = (
+    "Referência", "Marca", "Tipo Sugestão", "Vendedor", "Ação Comprador",
+    "Comentário Comprador", "Ordem Compra", "Código", "Descrição Código", "Data Lançamento"
+)
+
+@st.cache_data(
+    show_spinner=False,
+    hash_funcs={pd.DataFrame: lambda d: (len(d), tuple(d.columns), pd.util.hash_pandas_object(d, index=False).sum())}
+)
+def _compute_filter_options(df: pd.DataFrame) -> Dict[str, List[str]]:
+    """Opções ("(Todos)" + valores distintos, ordem case-insensitive) de cada coluna de filtro."""
+    opcoes: Dict[str, List[str]] = {}
+    for col in FILTRO_COLUNAS:
+        if col not in df.columns:
+            opcoes[col] = ["(Todos)"]
+            continue
+        vals = df[col].dropna().astype(str).str.strip()
+        vals = vals[vals != ""].unique()
+        opcoes[col] = ["(Todos)"] + sorted(vals, key=str.lower)
+    return opcoes
+
+@st.cache_data(
+    max_entries=16,
+    ttl=900,
+    show_spinner=False,
+    hash_funcs={pd.DataFrame: lambda d: hash((tuple(d.columns), pd.util.hash_pandas_object(d, index=False).sum()))}
+)
+def _build_xlsx(df: pd.DataFrame) -> bytes:
+    """Serializa o DataFrame em .xlsx (aba "Consulta")."""
+    buffer = io.BytesIO()
+    # Sem constant_memory: o pandas grava célula a célula por coluna, e nesse modo o
+    # xlsxwriter descarta o que não pertence à linha corrente
+    with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
+        df.to_excel(writer, index=False, sheet_name="Consulta")
+    return buffer.getvalue()
 
 # =========================================================
 # ESTADO INICIAL, CALLBACKS E LIMPEZA
@@ -271,7 +511,8 @@ def init_state_defaults():
         "tipo_sugestao": None,
         "comentario": "",
         # Itens por referência
-        "itens_ref": [],              # [(codigo, descricao)]
+        "itens_ref": _ITENS_VAZIO,    # {"codigos": (...), "descricoes": (...)}
+        "itens_map": {},              # {"CODIGO - DESCRIÇÃO": (codigo, descricao)}
         "item_escolhido": None,       # "CODIGO - DESCRIÇÃO"
         "codigo_item": None,
         "descricao_item": None,
@@ -298,8 +539,10 @@ def on_change_referencia():
     Callback disparado ao sair/confirmar o campo 'Referência'.
     Carrega itens para a referência e reseta seleção anterior.
     """
-    ref = (st.session_state.get("referencia") or "").strip()
-    st.session_state["itens_ref"] = []
+    # Normaliza antes de chamar: "abc " e "ABC" usam a mesma entrada do cache
+    ref = (st.session_state.get("referencia") or "").strip().upper()
+    st.session_state["itens_ref"] = _ITENS_VAZIO
+    st.session_state["itens_map"] = {}
     st.session_state["item_escolhido"] = None
     st.session_state["codigo_item"] = None
     st.session_state["descricao_item"] = None
@@ -307,9 +550,15 @@ def on_change_referencia():
         try:
             st.session_state["itens_ref"] = carregar_itens_por_referencia(ref)
         except Exception:
-            st.session_state["itens_ref"] = []
+            st.session_state["itens_ref"] = _ITENS_VAZIO
+    # Rótulo do selectbox -> (código, descrição), montado uma vez por referência
+    itens = st.session_state["itens_ref"]
+    st.session_state["itens_map"] = {
+        (f"{c} - {d}" if d else c): (c, d) for c, d in zip(itens["codigos"], itens["descricoes"])
+    }
 
 def do_logout():
+    st.session_state.pop("_sugestoes_future", None)
     st.session_state["authenticated"] = False
     st.session_state["usuario"] = None
     _rerun()
@@ -318,14 +567,15 @@ def apply_pending_clear():
     # Limpeza do FORM
     if st.session_state.get("_clear_after_save", False) or st.session_state.get("_clear_request", False):
         for key in ["referencia","quantidade","marca","tipo_sugestao","comentario",
-                    "itens_ref","item_escolhido","codigo_item","descricao_item"]:
+                    "itens_ref","itens_map","item_escolhido","codigo_item","descricao_item"]:
             st.session_state.pop(key, None)
         st.session_state["referencia"] = ""
         st.session_state["quantidade"] = None
         st.session_state["marca"] = ""
         st.session_state["tipo_sugestao"] = None
         st.session_state["comentario"] = ""
-        st.session_state["itens_ref"] = []
+        st.session_state["itens_ref"] = _ITENS_VAZIO
+        st.session_state["itens_map"] = {}
         st.session_state["item_escolhido"] = None
         st.session_state["codigo_item"] = None
         st.session_state["descricao_item"] = None
@@ -387,6 +637,7 @@ if not st.session_state.get("authenticated", False):
                 if ok:
                     st.session_state["authenticated"] = True
                     st.session_state["usuario"] = nome or user
+                    prefetch_sugestoes()
                     st.success(f"Bem-vindo(a), {st.session_state['usuario']}!")
                     time.sleep(0.6)
                     _rerun()
@@ -431,6 +682,107 @@ st.sidebar.markdown(
     unsafe_allow_html=True
 )
 
+# =========================================================
+# CONSULTA: FILTROS + TABELA (fragment)
+# =========================================================
+@_fragment
+def _consulta_fragment(df: pd.DataFrame):
+    """
+    Filtros, tabela e exportação. Como fragment, mudar um filtro reexecuta só
+    este bloco; o carregamento de /sugestoes fica fora dele.
+    """
+    # Opções dinâmicas (calculadas uma vez por versão dos dados). A versão gravada
+    # por carregar_sugestoes evita o hash do DataFrame inteiro a cada clique em filtro.
+    opts_sig = df.attrs.get("versao")
+    if "_opts" not in st.session_state or st.session_state.get("_opts_sig") != opts_sig:
+        st.session_state["_opts"] = _compute_filter_options(df)
+        st.session_state["_opts_sig"] = opts_sig
+    opcoes = st.session_state["_opts"]
+    opcoes_ref    = opcoes["Referência"]
+    opcoes_marca  = opcoes["Marca"]
+    opcoes_tipo   = opcoes["Tipo Sugestão"]
+    opcoes_vend   = opcoes["Vendedor"]
+    opcoes_acao   = opcoes["Ação Comprador"]
+    opcoes_compr  = opcoes["Comentário Comprador"]
+    opcoes_oc     = opcoes["Ordem Compra"]
+    opcoes_cod    = opcoes["Código"]
+    opcoes_desc   = opcoes["Descrição Código"]
+    opcoes_data   = opcoes["Data Lançamento"]
+
+    with st.expander("Filtros", expanded=True):
+        colf1, colf2, colf3 = st.columns(3)
+        colf4, colf5, colf6 = st.columns(3)
+        colf7, colf8, colf9 = st.columns(3)
+
+        filtro_ref = colf1.selectbox("Filtrar por Referência", options=opcoes_ref, key="f_ref")
+        filtro_marca = colf2.selectbox("Filtrar por Marca", options=opcoes_marca, key="f_marca")
+        filtro_tipo = colf3.selectbox("Filtrar por Tipo Sugestão", options=opcoes_tipo, key="f_tipo")
+
+        filtro_vendedor = colf4.selectbox("Filtrar por Vendedor", options=opcoes_vend, key="f_vendedor")
+        filtro_acao = colf5.selectbox("Filtrar por Ação Comprador", options=opcoes_acao, key="f_acao")
+        filtro_coment_comp = colf6.selectbox("Filtrar por Comentário Comprador", options=opcoes_compr, key="f_coment_comp")
+
+        filtro_oc = colf7.selectbox("Filtrar por Ordem Compra", options=opcoes_oc, key="f_oc")
+        filtro_codigo = colf8.selectbox("Filtrar por Código", options=opcoes_cod, key="f_codigo")
+        filtro_data = colf9.selectbox("Filtrar por Data Lançamento", options=opcoes_data, key="f_data")
+
+        # Aplica filtros: uma única máscara booleana, um único recorte do DataFrame
+        filtros = [
+            ("Referência", filtro_ref),
+            ("Marca", filtro_marca),
+            ("Tipo Sugestão", filtro_tipo),
+            ("Vendedor", filtro_vendedor),
+            ("Ação Comprador", filtro_acao),
+            ("Comentário Comprador", filtro_coment_comp),
+            ("Ordem Compra", filtro_oc),
+            ("Código", filtro_codigo),
+            ("Data Lançamento", filtro_data),
+        ]
+        # Sem filtro ativo usa o próprio df (nada abaixo o altera in place)
+        ativos = [(col, val) for col, val in filtros if val != "(Todos)" and col in df.columns]
+        df_filtrado = df
+        if ativos:
+            mask = np.ones(len(df), dtype=bool)
+            for col, val in ativos:
+                mask &= (df[col] == val).to_numpy(dtype=bool, na_value=False)
+            df_filtrado = df.loc[mask]
+
+        # Ordem e exibição
+        colunas_ordem = [
+            "Referência", "Quantidade", "Marca", "Tipo Sugestão", "Comentário Vendedor",
+            "Vendedor", "Ação Comprador", "Comentário Comprador",
+            "Ordem Compra", "Código", "Descrição Código", "Data Lançamento"
+        ]
+        colunas_existentes = [c for c in colunas_ordem if c in df_filtrado.columns]
+        outras = [c for c in df_filtrado.columns if c not in colunas_existentes]
+        df_exibir = df_filtrado[colunas_existentes + outras]
+        if "Referência" in df_exibir.columns:
+            df_exibir = df_exibir.sort_values(by=["Referência"], ascending=True)
+
+        # Botões
+        colb1, colb2 = st.columns([0.2, 0.8])
+        if colb1.button("🧽 Limpar filtros"):
+            st.session_state["_clear_filters_request"] = True
+            _rerun()
+
+        # Exportar Excel: só serializa quando o usuário pede (não a cada rerun)
+        xlsx_sig = (df.attrs.get("versao"), tuple(filtros))
+        if colb2.button("📊 Gerar Excel", use_container_width=True):
+            st.session_state["_xlsx_bytes"] = _build_xlsx(df_exibir)
+            st.session_state["_xlsx_sig"] = xlsx_sig
+        if "_xlsx_bytes" in st.session_state and st.session_state.get("_xlsx_sig") == xlsx_sig:
+            colb2.download_button(
+                label="📥 Exportar Excel",
+                data=st.session_state["_xlsx_bytes"],
+                file_name="consulta_sugestoes.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                use_container_width=True
+            )
+
+    # Tabela
+    st.dataframe(df_exibir, use_container_width=True, hide_index=True)
+    st.caption(f"Total de registros: {len(df_exibir)}")
+
 # =========================================================
 # PÁGINA: SUGESTÃO DO VENDEDOR
 # =========================================================
@@ -441,7 +793,7 @@ if pagina == "SUGESTÃO DO VENDEDOR":
     st.text_input("Referência *", key="referencia", on_change=on_change_referencia)
     # (Opcional) Mostrar contagem de itens retornados
     if st.session_state.get("referencia", "").strip():
-        qtd_itens = len(st.session_state.get("itens_ref", []))
+        qtd_itens = len(st.session_state.get("itens_ref", _ITENS_VAZIO)["codigos"])
         st.caption(f"Itens encontrados para a referência: **{qtd_itens}**")
 
     with st.form("form_sugestao", clear_on_submit=False):
@@ -449,10 +801,7 @@ if pagina == "SUGESTÃO DO VENDEDOR":
 
         with col1:
             # Select de Código/Descrição (obrigatório)
-            opcoes_itens = []
-            for (cod, desc) in st.session_state.get("itens_ref", []):
-                label = f"{cod} - {desc}" if desc else f"{cod}"
-                opcoes_itens.append(label)
+            opcoes_itens = list(st.session_state.get("itens_map", {}).keys())
 
             st.selectbox(
                 "Código Item / Descrição do Item *",
@@ -465,18 +814,14 @@ if pagina == "SUGESTÃO DO VENDEDOR":
             # Ao escolher, extrai código e descrição
             item_escolhido = st.session_state.get("item_escolhido")
             if item_escolhido:
-                for (cod, desc) in st.session_state.get("itens_ref", []):
-                    label = f"{cod} - {desc}" if desc else f"{cod}"
-                    if label == item_escolhido:
-                        st.session_state["codigo_item"] = cod
-                        st.session_state["descricao_item"] = desc
-                        break
+                pair = st.session_state.get("itens_map", {}).get(item_escolhido)
+                if pair:
+                    st.session_state["codigo_item"], st.session_state["descricao_item"] = pair
 
             # Quantidade
-            quantidades = list(range(1, 1001))
             st.selectbox(
                 "Quantidade *",
-                options=quantidades,
+                options=_QUANTIDADES,
                 index=None,
                 placeholder="Selecione a quantidade",
                 key="quantidade"
@@ -487,10 +832,9 @@ if pagina == "SUGESTÃO DO VENDEDOR":
 
         with col2:
             # Tipo Sugestão
-            opcoes_tipo = ["VENDA_CASADA", "VENDA_PERDIDA"]
             st.selectbox(
                 "Tipo Sugestão *",
-                options=opcoes_tipo,
+                options=_TIPOS,
                 index=None,
                 placeholder="Selecione o tipo de sugestão",
                 key="tipo_sugestao"
@@ -520,7 +864,7 @@ if pagina == "SUGESTÃO DO VENDEDOR":
         comentario = (st.session_state.comentario or "").strip()
         codigo_item = st.session_state.get("codigo_item", None)
         descricao_item = st.session_state.get("descricao_item", None)
-        itens_ref = st.session_state.get("itens_ref", [])
+        itens_ref = st.session_state.get("itens_ref", _ITENS_VAZIO)["codigos"]
         vendedor = st.session_state.get("usuario", "")
 
         erros = []
@@ -552,6 +896,9 @@ if pagina == "SUGESTÃO DO VENDEDOR":
                     descricao=descricao_item,
                     vendedor=vendedor
                 )
+                # A consulta deve enxergar o registro recém-salvo
+                carregar_sugestoes.clear()
+                prefetch_sugestoes()
                 st.session_state["_pending_success"] = True
                 st.session_state["_clear_after_save"] = True
                 _rerun()
@@ -566,102 +913,17 @@ else:
     st.title("🔎 Consulta Sugestão")
 
     try:
-        df = carregar_sugestoes()
-
-        # Opções dinâmicas
-        def _uniq(dfcol):
-            if dfcol not in df.columns:
-                return []
-            vals = [str(x) for x in df[dfcol].dropna().unique()]
-            vals = [v.strip() for v in vals if v.strip() != ""]
-            return sorted(vals, key=lambda s: s.lower())
-
-        opcoes_ref    = ["(Todos)"] + _uniq("Referência")
-        opcoes_marca  = ["(Todos)"] + _uniq("Marca")
-        opcoes_tipo   = ["(Todos)"] + _uniq("Tipo Sugestão")
-        opcoes_vend   = ["(Todos)"] + _uniq("Vendedor")
-        opcoes_acao   = ["(Todos)"] + _uniq("Ação Comprador")
-        opcoes_compr  = ["(Todos)"] + _uniq("Comentário Comprador")
-        opcoes_oc     = ["(Todos)"] + _uniq("Ordem Compra")
-        opcoes_cod    = ["(Todos)"] + _uniq("Código")
-        opcoes_desc   = ["(Todos)"] + _uniq("Descrição Código")
-        opcoes_data   = ["(Todos)"] + _uniq("Data Lançamento")
-
-        with st.expander("Filtros", expanded=True):
-            colf1, colf2, colf3 = st.columns(3)
-            colf4, colf5, colf6 = st.columns(3)
-            colf7, colf8, colf9 = st.columns(3)
-
-            filtro_ref = colf1.selectbox("Filtrar por Referência", options=opcoes_ref, key="f_ref")
-            filtro_marca = colf2.selectbox("Filtrar por Marca", options=opcoes_marca, key="f_marca")
-            filtro_tipo = colf3.selectbox("Filtrar por Tipo Sugestão", options=opcoes_tipo, key="f_tipo")
-
-            filtro_vendedor = colf4.selectbox("Filtrar por Vendedor", options=opcoes_vend, key="f_vendedor")
-            filtro_acao = colf5.selectbox("Filtrar por Ação Comprador", options=opcoes_acao, key="f_acao")
-            filtro_coment_comp = colf6.selectbox("Filtrar por Comentário Comprador", options=opcoes_compr, key="f_coment_comp")
-
-            filtro_oc = colf7.selectbox("Filtrar por Ordem Compra", options=opcoes_oc, key="f_oc")
-            filtro_codigo = colf8.selectbox("Filtrar por Código", options=opcoes_cod, key="f_codigo")
-            filtro_data = colf9.selectbox("Filtrar por Data Lançamento", options=opcoes_data, key="f_data")
-
-            # Aplica filtros
-            df_filtrado = df.copy()
-            if filtro_ref != "(Todos)":
-                df_filtrado = df_filtrado[df_filtrado["Referência"] == filtro_ref]
-            if filtro_marca != "(Todos)":
-                df_filtrado = df_filtrado[df_filtrado["Marca"] == filtro_marca]
-            if filtro_tipo != "(Todos)":
-                df_filtrado = df_filtrado[df_filtrado["Tipo Sugestão"] == filtro_tipo]
-            if filtro_vendedor != "(Todos)":
-                df_filtrado = df_filtrado[df_filtrado["Vendedor"] == filtro_vendedor]
-            if filtro_acao != "(Todos)":
-                df_filtrado = df_filtrado[df_filtrado["Ação Comprador"] == filtro_acao]
-            if filtro_coment_comp != "(Todos)":
-                df_filtrado = df_filtrado[df_filtrado["Comentário Comprador"] == filtro_coment_comp]
-            if filtro_oc != "(Todos)":
-                df_filtrado = df_filtrado[df_filtrado["Ordem Compra"] == filtro_oc]
-            if filtro_codigo != "(Todos)":
-                df_filtrado = df_filtrado[df_filtrado["Código"] == filtro_codigo]
-            if filtro_data != "(Todos)":
-                df_filtrado = df_filtrado[df_filtrado["Data Lançamento"] == filtro_data]
-
-            # Ordem e exibição
-            colunas_ordem = [
-                "Referência", "Quantidade", "Marca", "Tipo Sugestão", "Comentário Vendedor",
-                "Vendedor", "Ação Comprador", "Comentário Comprador",
-                "Ordem Compra", "Código", "Descrição Código", "Data Lançamento"
-            ]
-            colunas_existentes = [c for c in colunas_ordem if c in df_filtrado.columns]
-            outras = [c for c in df_filtrado.columns if c not in colunas_existentes]
-            df_exibir = df_filtrado[colunas_existentes + outras]
-            if "Referência" in df_exibir.columns:
-                df_exibir = df_exibir.sort_values(by=["Referência"], ascending=True)
-
-            # Botões
-            colb1, colb2, colb3 = st.columns([0.2, 0.2, 0.6])
-            if colb1.button("🔄 Recarregar"):
-                carregar_sugestoes.clear()
-                _rerun()
-            if colb2.button("🧽 Limpar filtros"):
-                st.session_state["_clear_filters_request"] = True
-                _rerun()
+        df = carregar_sugestoes(_prefetch_recente())
 
-            # Exportar Excel
-            buffer = io.BytesIO()
-            with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-                df_exibir.to_excel(writer, index=False, sheet_name="Consulta")
-            buffer.seek(0)
-            colb3.download_button(
-                label="📥 Exportar Excel",
-                data=buffer.getvalue(),
-                file_name="consulta_sugestoes.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                use_container_width=True
-            )
+        if st.button("🔄 Recarregar"):
+            carregar_sugestoes.clear()
+            st.session_state.pop("_sugestoes_future", None)
+            st.session_state.pop("_xlsx_bytes", None)
+            st.session_state.pop("_opts_sig", None)
+            carregar_itens_por_referencia.clear()
+            _rerun()
 
-        # Tabela
-        st.dataframe(df_exibir, use_container_width=True, hide_index=True)
-        st.caption(f"Total de registros: {len(df_exibir)}")
+        _consulta_fragment(df)
 
     except Exception as ex:
         st.error("Erro ao consultar (API).")